@@ -17,7 +17,17 @@
 
 from pytest import raises
 import numpy as np
-from cirq import LineQubit, depolarize, Circuit
+from cirq import (
+    LineQubit,
+    depolarize,
+    Circuit,
+    FrozenCircuit,
+    DensityMatrixSimulator,
+    H,
+    CNOT,
+    measure,
+)
+from mitiq import utils
 from mitiq.pec.utils import (
     _max_ent_state_circuit,
     _operation_to_choi,
@@ -35,6 +45,9 @@ def test_max_ent_state_circuit():
     assert np.allclose(
         _max_ent_state_circuit(4).final_state_vector(), four_state
     )
+    # Check the frozen circuit is cached
+    assert isinstance(_max_ent_state_circuit(2), FrozenCircuit)
+    assert _max_ent_state_circuit(2) is _max_ent_state_circuit(2)
 
 
 def test_max_ent_state_circuit_error():
@@ -86,3 +99,65 @@ def test_circuit_to_choi():
         _operation_to_choi(noisy_sequence),
         _circuit_to_choi(Circuit(noisy_sequence)),
     )
+
+
+def test_circuit_to_choi_unitary_channel():
+    """Tests the Choi state of a unitary channel obtained with a state vector
+    simulation is equal to the one obtained with a density matrix simulation.
+    """
+    qreg = LineQubit.range(2)
+    circuit = Circuit(H.on(qreg[0]), CNOT.on(*qreg))
+    full_circ = Circuit()
+    full_circ += _max_ent_state_circuit(4)
+    full_circ += circuit
+    expected = DensityMatrixSimulator().simulate(full_circ)
+    choi = _circuit_to_choi(circuit)
+    assert np.allclose(choi, expected.final_density_matrix, atol=1.0e-6)
+    # The Choi state of a unitary channel is pure
+    assert np.isclose(np.trace(choi @ choi), 1.0)
+
+
+def test_circuit_to_choi_is_cached():
+    """Tests the Choi states of equivalent circuits are cached and copied."""
+    utils._CHOI_CACHE.clear()
+    q = LineQubit(0)
+    noisy_sequence = [depolarize(0.01).on(q), H.on(q)]
+    choi = _circuit_to_choi(Circuit(noisy_sequence))
+    assert len(utils._CHOI_CACHE) == 1
+    # A new but equal circuit is found in the cache
+    choi_again = _circuit_to_choi(Circuit(noisy_sequence))
+    assert len(utils._CHOI_CACHE) == 1
+    assert np.allclose(choi, choi_again)
+    # Mutating the returned matrix does not affect the cache
+    choi_again[0, 0] = 10.0
+    assert np.allclose(choi, _circuit_to_choi(Circuit(noisy_sequence)))
+    # Different circuits are cached separately
+    _circuit_to_choi(Circuit(noisy_sequence[::-1]))
+    assert len(utils._CHOI_CACHE) == 2
+
+
+def test_circuit_to_choi_with_measurements_is_not_cached():
+    """Tests the random Choi states of measured circuits are not cached."""
+    utils._CHOI_CACHE.clear()
+    q = LineQubit(0)
+    choi = _circuit_to_choi(Circuit(H.on(q), measure(q)))
+    assert choi.shape == (4, 4)
+    assert len(utils._CHOI_CACHE) == 0
+
+
+def test_circuit_to_choi_dtype():
+    """Tests the Choi state is returned with the requested data type."""
+    q = LineQubit(0)
+    for circuit in (Circuit(H.on(q)), Circuit(depolarize(0.01).on(q))):
+        choi = _circuit_to_choi(circuit)
+        assert choi.dtype == np.complex64
+        choi_double = _circuit_to_choi(circuit, dtype=np.complex128)
+        assert choi_double.dtype == np.complex128
+        assert np.allclose(choi, choi_double, atol=1.0e-6)
+        op_choi = _operation_to_choi(
+            circuit.all_operations(), dtype=np.complex128
+        )
+        assert op_choi.dtype == np.complex128
+
+    with raises(ValueError, match="The argument 'dtype' must"):
+        _circuit_to_choi(Circuit(H.on(q)), dtype=np.float64)
@@ -19,21 +19,25 @@
 
 """Utilities related to probabilistic error cancellation."""
 
-from copy import deepcopy
+from functools import lru_cache
+from typing import Any, Type
 
 import numpy as np
 
 from cirq import (
     Circuit,
+    FrozenCircuit,
     OP_TREE,
     H,
     CNOT,
     LineQubit,
-    DensityMatrixSimulator,
 )
 
+from mitiq.utils import _cached_choi
 
-def _max_ent_state_circuit(num_qubits: int) -> Circuit:
+
+@lru_cache(maxsize=4, typed=True)
+def _max_ent_state_circuit(num_qubits: int) -> FrozenCircuit:
     r"""Generates a circuit which prepares the maximally entangled state
     |\omega\rangle = U |0\rangle  = \sum_i |i\rangle \otimes |i\rangle .
 
@@ -43,7 +47,8 @@ def _max_ent_state_circuit(num_qubits: int) -> Circuit:
             maximally entangled state.
 
     Returns:
-        The circuits which prepares the state |\omega\rangle.
+        The circuits which prepares the state |\omega\rangle. The circuit
+        is cached and frozen, such that it cannot be mutated by callers.
 
     Raises:
         Value error: if num_qubits is not an even positive integer.
@@ -62,31 +67,41 @@ def _max_ent_state_circuit(num_qubits: int) -> Circuit:
         H.on_each(*alice_reg),
         # Correlate alice_register with bob_register
         [CNOT.on(alice_reg[i], bob_reg[i]) for i in range(num_qubits // 2)],
-    )
+    ).freeze()
 
 
-def _circuit_to_choi(circuit: Circuit) -> np.ndarray:
+def _circuit_to_choi(
+    circuit: Circuit, dtype: Type[Any] = np.complex64
+) -> np.ndarray:
     """Returns the density matrix of the Choi state associated to the
     input circuit.
 
     The density matrix completely characterizes the quantum channel induced by
     the input circuit (including the effect of noise if present).
 
+    If all the operations of the input circuit are unitary, the Choi state is
+    pure and it is obtained from a state vector simulation of 4^n amplitudes
+    (n being the number of qubits of the input circuit), rather than from a
+    density matrix simulation of 16^n entries.
+
+    The Choi states of the most recently used circuits are cached.
+
     Args:
         circuit: The input circuit.
+        dtype: The complex data type used in the simulation and for the
+            returned matrix. Either np.complex64 (default) or np.complex128.
     Returns:
         The density matrix of the Choi state associated to the input circuit.
+
+    Raises:
+        ValueError: If dtype is not a supported complex data type.
     """
-    simulator = DensityMatrixSimulator()
-    num_qubits = len(circuit.all_qubits())
-    # Copy and remove all operations
-    full_circ = deepcopy(circuit)[0:0]
-    full_circ += _max_ent_state_circuit(2 * num_qubits)
-    full_circ += circuit
-    return simulator.simulate(full_circ).final_density_matrix  # type: ignore
+    return _cached_choi(circuit, _max_ent_state_circuit, dtype)
 
 
-def _operation_to_choi(operation_tree: OP_TREE) -> np.ndarray:
+def _operation_to_choi(
+    operation_tree: OP_TREE, dtype: Type[Any] = np.complex64
+) -> np.ndarray:
     """Returns the density matrix of the Choi state associated to the
     input operation tree (e.g. a single operation or a sequence of operations).
 
@@ -95,8 +110,10 @@ def _operation_to_choi(operation_tree: OP_TREE) -> np.ndarray:
 
     Args:
         operation_tree: Nested list of operations.
+        dtype: The complex data type used in the simulation and for the
+            returned matrix. Either np.complex64 (default) or np.complex128.
     Returns:
         The density matrix of the Choi state associated to the input circuit.
     """
     circuit = Circuit(operation_tree)
-    return _circuit_to_choi(circuit)
+    return _circuit_to_choi(circuit, dtype)
@@ -34,8 +34,10 @@ from cirq import (
     depolarize,
 )
 
+from mitiq import utils
 from mitiq.utils import (
     _are_close_dict,
+    _circuit_fingerprint,
     _equal,
     _simplify_gate_exponent,
     _simplify_circuit_exponents,
@@ -209,18 +211,99 @@ def test_circuit_equality_equal_measurement_keys_nonterminal_measurements(
     )
 
 
+def test_circuit_fingerprint_ignores_moment_structure():
+    qreg = LineQubit.range(3)
+    circA = Circuit([X.on(qreg[0]), Y.on(qreg[2]), CNOT.on(*qreg[:2])])
+    circB = Circuit(
+        [
+            cirq.Moment([X.on(qreg[0])]),
+            cirq.Moment([Y.on(qreg[2])]),
+            cirq.Moment([CNOT.on(*qreg[:2])]),
+        ]
+    )
+    assert len(circA) != len(circB)
+    assert _circuit_fingerprint(circA) == _circuit_fingerprint(circB)
+    assert hash(_circuit_fingerprint(circA)) == hash(
+        _circuit_fingerprint(circB)
+    )
+    assert _equal(circA, circB, require_qubit_equality=True)
+
+    circC = Circuit([CNOT.on(*qreg[:2]), X.on(qreg[0]), Y.on(qreg[2])])
+    assert _circuit_fingerprint(circA) != _circuit_fingerprint(circC)
+    assert not _equal(circA, circC)
+
+
+def test_circuit_equality_is_operation_equality_on_each_qubit():
+    qreg = LineQubit.range(2)
+    # CZ is symmetric in its qubits while CNOT is not
+    assert _equal(Circuit(cirq.CZ.on(*qreg)), Circuit(cirq.CZ.on(*qreg[::-1])))
+    assert not _equal(Circuit(CNOT.on(*qreg)), Circuit(CNOT.on(*qreg[::-1])))
+    # Exponents are compared up to their period
+    assert _equal(Circuit(X.on(qreg[0])), Circuit((X ** 3).on(qreg[0])))
+    # Commuting operations on a shared qubit are not reordered
+    assert not _equal(
+        Circuit(Z.on(qreg[0]), cirq.CZ.on(*qreg)),
+        Circuit(cirq.CZ.on(*qreg), Z.on(qreg[0])),
+    )
+
+
+def test_circuit_equality_with_qubitless_operations():
+    q = LineQubit(0)
+    circA = Circuit(X.on(q), cirq.GlobalPhaseOperation(1j))
+    circB = Circuit(X.on(q), cirq.GlobalPhaseOperation(-1))
+    assert _equal(circA, deepcopy(circA))
+    assert not _equal(circA, circB)
+    assert not _equal(circA, circB, require_qubit_equality=True)
+    # Qubit-less operations can be reordered with any operation
+    circC = Circuit(
+        X.on(q), cirq.GlobalPhaseOperation(1j), cirq.GlobalPhaseOperation(-1)
+    )
+    circD = Circuit(
+        X.on(q), cirq.GlobalPhaseOperation(-1), cirq.GlobalPhaseOperation(1j)
+    )
+    assert _equal(circC, circD)
+    assert _equal(circC, circD, require_qubit_equality=True)
+    assert not _equal(circC, circA)
+
+
+def test_circuit_equality_unequal_measurement_keys_tagged_measurements():
+    q = LineQubit(0)
+    circ1 = Circuit(H.on(q), cirq.measure(q, key="a").with_tags("t"))
+    circ2 = Circuit(H.on(q), cirq.measure(q, key="b").with_tags("t"))
+    assert _equal(circ1, circ2, require_measurement_equality=False)
+    assert not _equal(circ1, circ2, require_measurement_equality=True)
+
+
+def test_circuit_fingerprint_ignore_qubits_and_measurement_keys():
+    circA = Circuit(H.on(LineQubit(0)), cirq.measure(LineQubit(0), key="a"))
+    circB = Circuit(
+        H.on(cirq.NamedQubit("q")), cirq.measure(cirq.NamedQubit("q"))
+    )
+    assert _circuit_fingerprint(circA) != _circuit_fingerprint(circB)
+    assert _circuit_fingerprint(
+        circA, ignore_qubits=True, ignore_meas_keys=True
+    ) == _circuit_fingerprint(circB, ignore_qubits=True, ignore_meas_keys=True)
+    assert _circuit_fingerprint(
+        circA, ignore_qubits=True
+    ) != _circuit_fingerprint(circB, ignore_qubits=True)
+
+
 @pytest.mark.parametrize("gate", [X ** 3, Y ** -3, Z ** -1, H ** -1])
 def test_simplify_gate_exponent(gate):
     # Check exponent is simplified to 1
     assert _simplify_gate_exponent(gate).exponent == 1
     # Check simplified gate is equivalent to the input
     assert _simplify_gate_exponent(gate) == gate
+    # Check the simplification is cached
+    assert _simplify_gate_exponent(gate) is _simplify_gate_exponent(gate)
 
 
 @pytest.mark.parametrize("gate", [T ** -1, S ** -1, MeasurementGate(1)])
 def test_simplify_gate_exponent_with_gates_that_cannot_be_simplified(gate):
     # Check the gate is not simplified (same representation)
     assert _simplify_gate_exponent(gate).__repr__() == gate.__repr__()
+    # Check the input gate itself is returned
+    assert _simplify_gate_exponent(gate) is gate
 
 
 def test_simplify_circuit_exponents():
@@ -273,6 +356,22 @@ def test_simplify_circuit_exponents_with_non_self_inverse_gates():
     assert simplified_qasm == inverse_qasm
 
 
+def test_simplify_circuit_exponents_with_tagged_operations():
+    q = LineQubit(0)
+    # Tagged gates which cannot be simplified are left unchanged
+    tagged_t = T.on(q).with_tags("t")
+    circuit = Circuit(tagged_t)
+    _simplify_circuit_exponents(circuit)
+    assert circuit == Circuit(tagged_t)
+    assert next(circuit.all_operations()) is tagged_t
+
+    # Tagged gates are simplified and keep their tags
+    circuit = Circuit((X ** 3).on(q).with_tags("t"))
+    _simplify_circuit_exponents(circuit)
+    assert circuit == Circuit(X.on(q).with_tags("t"))
+    assert repr(circuit) == repr(Circuit(X.on(q).with_tags("t")))
+
+
 def test_are_close_dict():
     """Tests the _are_close_dict function."""
     dict1 = {"a": 1, "b": 0.0}
@@ -303,6 +402,9 @@ def test_max_ent_state_circuit():
     assert np.allclose(
         _max_ent_state_circuit(4).final_state_vector(), four_state
     )
+    # Check the frozen circuit is cached
+    assert isinstance(_max_ent_state_circuit(2), cirq.FrozenCircuit)
+    assert _max_ent_state_circuit(2) is _max_ent_state_circuit(2)
 
 
 def test_circuit_to_choi_and_operation_to_choi():
@@ -334,3 +436,34 @@ def test_circuit_to_choi_and_operation_to_choi():
     print(_circuit_to_choi(noisy_circuit_twice))
     print(choi_twice)
     assert np.allclose(choi_twice, _circuit_to_choi(noisy_circuit_twice))
+
+
+def test_circuit_to_choi_unitary_channel():
+    """Tests the Choi state of a unitary channel is recovered."""
+    q = LineQubit(0)
+    # The Choi state of the X gate is (X \otimes I) |omega>
+    x_state = np.array([0, 1, 1, 0]) / np.sqrt(2)
+    assert np.allclose(
+        _circuit_to_choi(Circuit(X.on(q))), np.outer(x_state, x_state)
+    )
+
+
+def test_circuit_to_choi_cache_is_bounded_in_size(monkeypatch):
+    """Tests least recently used Choi states are evicted from the cache."""
+    utils._CHOI_CACHE.clear()
+    q = LineQubit(0)
+    one_qubit_nbytes = _circuit_to_choi(Circuit(X.on(q))).nbytes
+    monkeypatch.setattr(utils, "_CHOI_CACHE_NBYTES", 2 * one_qubit_nbytes)
+    _circuit_to_choi(Circuit(Y.on(q)))
+    _circuit_to_choi(Circuit(Z.on(q)))
+    assert len(utils._CHOI_CACHE) == 2
+    # The Choi state of X was the least recently used
+    x_key = (
+        _circuit_fingerprint(Circuit(X.on(q))),
+        np.complex64,
+        _max_ent_state_circuit,
+    )
+    assert x_key not in utils._CHOI_CACHE
+    # Two-qubit Choi states exceed the bound and are not cached
+    _circuit_to_choi(Circuit(CNOT.on(q, LineQubit(1))))
+    assert len(utils._CHOI_CACHE) == 2
@@ -14,27 +14,92 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 """Utility functions."""
-from copy import deepcopy
-from typing import cast, Any, Dict
+from collections import Counter
+from functools import lru_cache
+from typing import cast, Any, Callable, Dict, List, Optional, Tuple, Type
 
 import numpy as np
+from scipy.linalg.blas import get_blas_funcs
 
 from cirq import (
     LineQubit,
+    LineQid,
     Circuit,
-    CircuitDag,
+    FrozenCircuit,
     EigenGate,
     Gate,
     GateOperation,
     Moment,
+    Operation,
+    Qid,
+    TaggedOperation,
     CNOT,
     H,
+    XPowGate,
+    YPowGate,
+    ZPowGate,
+    HPowGate,
+    CXPowGate,
+    CZPowGate,
+    SwapPowGate,
+    ISwapPowGate,
     DensityMatrixSimulator,
+    Simulator,
+    StateVectorTrialResult,
     OP_TREE,
+    has_unitary,
+    is_measurement,
+    qid_shape,
 )
 from cirq.ops.measurement_gate import MeasurementGate
 
 
+# Simulators for each supported complex data type
+_DM_SIMULATORS = {
+    dtype: DensityMatrixSimulator(dtype=dtype)
+    for dtype in (np.complex64, np.complex128)
+}
+_SV_SIMULATORS = {
+    dtype: Simulator(dtype=dtype) for dtype in (np.complex64, np.complex128)
+}
+
+# Least recently used cache of Choi states, keyed by circuit fingerprint,
+# data type and maximally entangled state circuit, bounded both in number of
+# entries and in total size (bytes)
+_CHOI_CACHE: Dict[Any, np.ndarray] = {}
+_CHOI_CACHE_SIZE = 256
+_CHOI_CACHE_NBYTES = 2 ** 26
+
+# EigenGates which are completely specified by their exponent and global shift
+_EXPONENT_ONLY_GATE_TYPES = (
+    XPowGate,
+    YPowGate,
+    ZPowGate,
+    HPowGate,
+    CXPowGate,
+    CZPowGate,
+    SwapPowGate,
+    ISwapPowGate,
+)
+
+
+@lru_cache(maxsize=4096, typed=True)
+def _simplify_exponent_cached(
+    gate_type: type, exponent: Any, global_shift: Any
+) -> Optional[EigenGate]:
+    """Returns the simplified gate of type gate_type with the given exponent
+    and global shift, or None if its exponent is 1 or cannot be simplified.
+    """
+    if exponent == 1:
+        # Nothing to simplify
+        return None
+    gate = gate_type(exponent=exponent, global_shift=global_shift)
+    simplified_gate = gate._with_exponent(1)
+    if gate == simplified_gate:
+        return simplified_gate
+    return None
+
+
 def _simplify_gate_exponent(gate: EigenGate) -> EigenGate:
     """Returns the input gate with a simplified exponent if possible,
     otherwise the input gate is returned without any change.
@@ -46,12 +111,39 @@ def _simplify_gate_exponent(gate: EigenGate) -> EigenGate:
 
     Returns: The simplified gate.
     """
+    if type(gate) in _EXPONENT_ONLY_GATE_TYPES:
+        try:
+            simplified_gate = _simplify_exponent_cached(
+                type(gate), gate._exponent, gate._global_shift
+            )
+            return gate if simplified_gate is None else simplified_gate
+        except TypeError:
+            # Unhashable exponent, fall back to the uncached simplification
+            pass
+
     # Try to simplify the gate exponent to 1
-    if hasattr(gate, "_with_exponent") and gate == gate._with_exponent(1):
-        return gate._with_exponent(1)
+    if hasattr(gate, "_with_exponent"):
+        simplified_gate = gate._with_exponent(1)
+        if gate == simplified_gate:
+            return simplified_gate
     return gate
 
 
+def _with_gate(op: Operation, gate: Gate) -> Operation:
+    """Returns a copy of the input operation, possibly tagged, with its gate
+    replaced by the input gate. The tags of the operation are kept.
+
+    Args:
+        op: The input operation.
+        gate: The new gate of the operation.
+
+    Returns: The operation with the new gate.
+    """
+    if isinstance(op, TaggedOperation):
+        return _with_gate(op.sub_operation, gate).with_tags(*op.tags)
+    return cast(GateOperation, op).with_gate(gate)
+
+
 def _simplify_circuit_exponents(circuit: Circuit) -> None:
     """Simplifies the gate exponents of the input circuit if possible,
     mutating the input circuit.
@@ -61,18 +153,84 @@ def _simplify_circuit_exponents(circuit: Circuit) -> None:
     """
     # Iterate over moments
     for moment_idx, moment in enumerate(circuit):
-        simplified_operations = []
+        operations = moment.operations
+        # Copy of the operations, made when the first gate is simplified
+        simplified_operations: Optional[List[Operation]] = None
         # Iterate over operations in moment
-        for op in moment:
-            assert isinstance(op, GateOperation)
-            if isinstance(op.gate, EigenGate):
-                simplified_gate: Gate = _simplify_gate_exponent(op.gate)
-            else:
-                simplified_gate = op.gate
-            simplified_operation = op.with_gate(simplified_gate)
-            simplified_operations.append(simplified_operation)
-        # Mutate the input circuit
-        circuit[moment_idx] = Moment(simplified_operations)
+        for op_idx, op in enumerate(operations):
+            gate = op.gate
+            if not isinstance(gate, EigenGate):
+                continue
+            simplified_gate = _simplify_gate_exponent(gate)
+            if simplified_gate is not gate:
+                if simplified_operations is None:
+                    simplified_operations = list(operations)
+                simplified_operations[op_idx] = _with_gate(op, simplified_gate)
+        # Mutate the input circuit only if some gate has been simplified
+        if simplified_operations is not None:
+            circuit[moment_idx] = Moment(simplified_operations)
+
+
+def _circuit_fingerprint(
+    circuit: Circuit,
+    ignore_qubits: bool = False,
+    ignore_meas_keys: bool = False,
+    qubits: Optional[List[Qid]] = None,
+) -> Tuple[Tuple[Any, Any], ...]:
+    """Returns a hashable canonical form of the input circuit.
+
+    For each qubit, the canonical form contains the ordered sequence of
+    operations acting on it. Hence it does not depend on the moment structure
+    of the circuit nor on the relative order of operations acting on disjoint
+    qubits. Operations acting on no qubits (e.g. global phases) are collected
+    in a separate multiset, since they can be reordered with any operation.
+    The input circuit is not mutated.
+
+    Args:
+        circuit: The circuit to fingerprint.
+        ignore_qubits: If True, the qubits of the circuit are replaced by
+            canonical qubits according to their sorted order.
+        ignore_meas_keys: If True, the keys of all measurements are removed.
+        qubits: The sorted qubits of the circuit, if already known.
+
+    Returns:
+        A tuple of (qubit label, operations) pairs, one for each qubit,
+        followed by a (None, frozenset of (operation, count) pairs) pair for
+        the qubit-less operations.
+    """
+    if qubits is None:
+        qubits = sorted(circuit.all_qubits())
+    # Bound lookup of the canonical qubit replacing each qubit
+    to_canonical = {
+        q: LineQid(i, dimension=q.dimension) for i, q in enumerate(qubits)
+    }.__getitem__
+    wires: Dict[Qid, List[Operation]] = {q: [] for q in qubits}
+    qubitless_ops: List[Operation] = []
+    # Measurement gates without key, shared by equivalent measurements
+    keyless_gates: Dict[MeasurementGate, MeasurementGate] = {}
+
+    for op in circuit.all_operations():
+        gate = op.gate
+        if ignore_meas_keys and isinstance(gate, MeasurementGate) and gate.key:
+            if gate not in keyless_gates:
+                keyless_gates[gate] = MeasurementGate(
+                    key="",
+                    invert_mask=gate.invert_mask,
+                    qid_shape=qid_shape(gate),
+                )
+            op = _with_gate(op, keyless_gates[gate])
+        op_qubits = op.qubits
+        if ignore_qubits:
+            op = op.with_qubits(*map(to_canonical, op_qubits))
+        if not op_qubits:
+            qubitless_ops.append(op)
+        for q in op_qubits:
+            wires[q].append(op)
+
+    return tuple(
+        (i if ignore_qubits else q, tuple(wires[q]))
+        for i, q in enumerate(qubits)
+    ) + ((None, frozenset(Counter(qubitless_ops).items())),)
 
 
 def _equal(
@@ -83,6 +241,10 @@ def _equal(
 ) -> bool:
     """Returns True if the circuits are equal, else False.
 
+    Two circuits are equal if each qubit is acted on by the same sequence of
+    operations in both circuits, i.e., if they are equal up to reordering
+    operations which act on disjoint qubits (as for cirq.CircuitDag).
+
     Args:
         circuit_one: Input circuit to compare to circuit_two.
         circuit_two: Input circuit to compare to circuit_one.
@@ -100,54 +262,49 @@ def _equal(
     if circuit_one is circuit_two:
         return True
 
-    circuit_one = deepcopy(circuit_one)
-    circuit_two = deepcopy(circuit_two)
-
-    if not require_qubit_equality:
-        # Transform the qubits of circuit one to those of circuit two
-        qubit_map = dict(
-            zip(
-                sorted(circuit_one.all_qubits()),
-                sorted(circuit_two.all_qubits()),
-            )
-        )
-        circuit_one = circuit_one.transform_qubits(lambda q: qubit_map[q])
-
-    if not require_measurement_equality:
-        for circ in (circuit_one, circuit_two):
-            measurements = [
-                (moment, op)
-                for moment, op, _ in circ.findall_operations_with_gate_type(
-                    MeasurementGate
-                )
-            ]
-            circ.batch_remove(measurements)
-
-            for i in range(len(measurements)):
-                gate = cast(MeasurementGate, measurements[i][1].gate)
-                gate.key = ""
-
-            circ.batch_insert(measurements)
+    # Cheap necessary conditions before computing the canonical forms
+    qubits_one = sorted(circuit_one.all_qubits())
+    qubits_two = sorted(circuit_two.all_qubits())
+    if require_qubit_equality:
+        if qubits_one != qubits_two:
+            return False
+    elif len(qubits_one) != len(qubits_two):
+        return False
+    if sum(1 for _ in circuit_one.all_operations()) != sum(
+        1 for _ in circuit_two.all_operations()
+    ):
+        return False
 
-    return CircuitDag.from_circuit(circuit_one) == CircuitDag.from_circuit(
-        circuit_two
+    return _circuit_fingerprint(
+        circuit_one,
+        ignore_qubits=not require_qubit_equality,
+        ignore_meas_keys=not require_measurement_equality,
+        qubits=qubits_one,
+    ) == _circuit_fingerprint(
+        circuit_two,
+        ignore_qubits=not require_qubit_equality,
+        ignore_meas_keys=not require_measurement_equality,
+        qubits=qubits_two,
     )
 
 
 def _are_close_dict(dict_a: Dict[Any, Any], dict_b: Dict[Any, Any]) -> bool:
     """Returns True if the two dictionaries have equal keys and
     their corresponding values are "sufficiently" close."""
-    keys_a = dict_a.keys()
-    keys_b = dict_b.keys()
-    if set(keys_a) != set(keys_b):
+    keys = dict_a.keys()
+    if keys != dict_b.keys():
         return False
-    for ka, va in dict_a.items():
-        if not np.isclose(dict_b[ka], va):
-            return False
-    return True
+    values_a = np.fromiter(
+        (dict_a[k] for k in keys), dtype=np.complex128, count=len(keys)
+    )
+    values_b = np.fromiter(
+        (dict_b[k] for k in keys), dtype=np.complex128, count=len(keys)
+    )
+    return bool(np.allclose(values_b, values_a))
 
 
-def _max_ent_state_circuit(num_qubits: int) -> Circuit:
+@lru_cache(maxsize=4, typed=True)
+def _max_ent_state_circuit(num_qubits: int) -> FrozenCircuit:
     r"""Generates a circuits which prepares the maximally entangled state
     |\omega\rangle = U |0\rangle  = \sum_i |i\rangle \otimes |i\rangle .
 
@@ -156,7 +313,8 @@ def _max_ent_state_circuit(num_qubits: int) -> Circuit:
             Only 2 or 4 qubits are supported.
 
     Returns:
-        The circuits which prepares the state |\omega\rangle.
+        The circuits which prepares the state |\omega\rangle. The circuit
+        is cached and frozen, such that it cannot be mutated by callers.
     """
 
     qreg = LineQubit.range(num_qubits)
@@ -175,31 +333,123 @@ def _max_ent_state_circuit(num_qubits: int) -> Circuit:
         raise NotImplementedError(
             "Only 2- or 4-qubit maximally entangling circuits are supported."
         )
-    return circ
+    return circ.freeze()
+
+
+def _simulate_choi(
+    circuit: Circuit,
+    max_ent_state_circuit: Callable[[int], FrozenCircuit],
+    dtype: Type[Any],
+) -> np.ndarray:
+    """Simulates the density matrix of the Choi state associated to the
+    input circuit with the given complex data type. See _circuit_to_choi.
+    """
+    num_qubits = len(circuit.all_qubits())
+    full_circ = Circuit()
+    full_circ += max_ent_state_circuit(2 * num_qubits)
+    full_circ += circuit
+
+    # If the channel is unitary, the Choi state is pure and can be obtained
+    # with a (cheaper) state vector simulation.
+    if all(has_unitary(op) for op in circuit.all_operations()):
+        sv_result = cast(
+            StateVectorTrialResult, _SV_SIMULATORS[dtype].simulate(full_circ)
+        )
+        psi = sv_result.final_state_vector
+        # Rank-1 update |psi><psi| with the BLAS routine matching psi.dtype
+        geru = get_blas_funcs("geru", (psi,))
+        return geru(1.0, psi, psi.conj())
+
+    result = _DM_SIMULATORS[dtype].simulate(full_circ)
+    return result.final_density_matrix  # type: ignore
 
 
-def _circuit_to_choi(circuit: Circuit) -> np.ndarray:
+def _cached_choi(
+    circuit: Circuit,
+    max_ent_state_circuit: Callable[[int], FrozenCircuit],
+    dtype: Type[Any],
+) -> np.ndarray:
+    """Returns the density matrix of the Choi state associated to the input
+    circuit, prepared with the given maximally entangled state circuit. The
+    Choi states of the most recently used circuits without measurements are
+    cached.
+
+    Args:
+        circuit: The input circuit.
+        max_ent_state_circuit: Function returning the circuit which prepares
+            the maximally entangled state of the given number of qubits.
+        dtype: The complex data type used in the simulation and for the
+            returned matrix. Either np.complex64 or np.complex128.
+    Returns:
+        The density matrix of the Choi state associated to the input circuit.
+
+    Raises:
+        ValueError: If dtype is not a supported complex data type.
+    """
+    dtype = np.dtype(dtype).type
+    if dtype not in _DM_SIMULATORS:
+        raise ValueError(
+            "The argument 'dtype' must be np.complex64 or np.complex128 "
+            f"but {dtype} was given."
+        )
+
+    if is_measurement(circuit):
+        # Measurements collapse the simulated state, which is then random
+        return _simulate_choi(circuit, max_ent_state_circuit, dtype)
+
+    key = (_circuit_fingerprint(circuit), dtype, max_ent_state_circuit)
+    try:
+        choi = _CHOI_CACHE.pop(key)
+    except KeyError:
+        choi = _simulate_choi(circuit, max_ent_state_circuit, dtype)
+        if choi.nbytes > _CHOI_CACHE_NBYTES:
+            # Too large to be cached
+            return choi
+    except TypeError:
+        # Circuits with unhashable operations are not cached
+        return _simulate_choi(circuit, max_ent_state_circuit, dtype)
+
+    # Store as the most recently used entry, evicting the least recent ones
+    _CHOI_CACHE[key] = choi
+    while len(_CHOI_CACHE) > _CHOI_CACHE_SIZE or (
+        sum(c.nbytes for c in _CHOI_CACHE.values()) > _CHOI_CACHE_NBYTES
+    ):
+        del _CHOI_CACHE[next(iter(_CHOI_CACHE))]
+    return choi.copy()
+
+
+def _circuit_to_choi(
+    circuit: Circuit, dtype: Type[Any] = np.complex64
+) -> np.ndarray:
     """Returns the density matrix of the Choi state associated to the
     input circuit.
 
     The density matrix completely characterizes the quantum channel induced by
     the input circuit (including the effect of noise if present).
 
+    If all the operations of the input circuit are unitary, the Choi state is
+    pure and it is obtained from a state vector simulation of 4^n amplitudes
+    (n being the number of qubits of the input circuit), rather than from a
+    density matrix simulation of 16^n entries.
+
+    The Choi states of the most recently used circuits are cached.
+
     Args:
         circuit: The input circuit.
+        dtype: The complex data type used in the simulation and for the
+            returned matrix. Either np.complex64 (default) or np.complex128.
     Returns:
         The density matrix of the Choi state associated to the input circuit.
+
+    Raises:
+        ValueError: If dtype is not a supported complex data type.
     """
-    simulator = DensityMatrixSimulator()
-    num_qubits = len(circuit.all_qubits())
-    # Copy and remove all operations
-    full_circ = deepcopy(circuit)[0:0]
-    full_circ += _max_ent_state_circuit(2 * num_qubits)
-    full_circ += circuit
-    return simulator.simulate(full_circ).final_density_matrix  # type: ignore
+    return _cached_choi(circuit, _max_ent_state_circuit, dtype)
 
 
-def _operation_to_choi(operation_tree: OP_TREE) -> np.ndarray:
+def _operation_to_choi(
+    operation_tree: OP_TREE, dtype: Type[Any] = np.complex64
+) -> np.ndarray:
     """Returns the density matrix of the Choi state associated to the
     input operation tree (e.g. a single operation or a sequence of operations).
 
@@ -208,8 +458,10 @@ def _operation_to_choi(operation_tree: OP_TREE) -> np.ndarray:
 
     Args:
         circuit: The input circuit.
+        dtype: The complex data type used in the simulation and for the
+            returned matrix. Either np.complex64 (default) or np.complex128.
     Returns:
         The density matrix of the Choi state associated to the input circuit.
     """
     circuit = Circuit(operation_tree)
-    return _circuit_to_choi(circuit)
+    return _circuit_to_choi(circuit, dtype)